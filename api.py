@@ -6,27 +6,44 @@ import json
 import datetime
 import logging
 import hashlib
+import signal
+import threading
+import time
 import uuid
 from optparse import OptionParser
-from http.server import HTTPServer, BaseHTTPRequestHandler
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
 
-from scoring import get_score, get_interests
+from capture import TrafficRecorder
+from compression import Compressor, decompress
+from limits import RateLimiter
+from profiling import RequestProfiler
+from scoring import get_score, get_interests_many, get_interests_as_of, get_interests_versions
+from store import Store, LocalCache, DeadlineExceeded
+from unixsocket import UnixHTTPServer
+from warmup import CacheWarmer, load_keys, hot_keys_from_log
 
 SALT = "Otus"
 ADMIN_LOGIN = "admin"
 ADMIN_SALT = "42"
 OK = 200
+NOT_MODIFIED = 304
 BAD_REQUEST = 400
 FORBIDDEN = 403
 NOT_FOUND = 404
 INVALID_REQUEST = 422
+TOO_MANY_REQUESTS = 429
 INTERNAL_ERROR = 500
+SERVICE_UNAVAILABLE = 503
+GATEWAY_TIMEOUT = 504
 ERRORS = {
     BAD_REQUEST: "Bad Request",
     FORBIDDEN: "Forbidden",
     NOT_FOUND: "Not Found",
     INVALID_REQUEST: "Invalid Request",
+    TOO_MANY_REQUESTS: "Too Many Requests",
     INTERNAL_ERROR: "Internal Server Error",
+    SERVICE_UNAVAILABLE: "Service Unavailable",
+    GATEWAY_TIMEOUT: "Gateway Timeout",
 }
 UNKNOWN = 0
 MALE = 1
@@ -132,23 +149,26 @@ class ClientIDsField(BaseField):
 
 
 class RequestMeta(type):
-    """у создаваемого класса убираем все дескрипторы в отдельный словарь "fields" """
+    """у создаваемого класса убираем все дескрипторы в отдельный словарь "fields",
+    значения полей запроса хранятся в слотах с теми же именами"""
     def __new__(mcl, name, bases, attrs):
         fields = {}
         for key, value in list(attrs.items()):
             if isinstance(value, BaseField):
                 fields[key] = attrs.pop(key)
         attrs['fields'] = fields
+        attrs['__slots__'] = tuple(attrs.get('__slots__', ())) + tuple(fields)
         return super().__new__(mcl, name, bases, attrs)
 
 
 class BaseRequest(metaclass=RequestMeta):
+    __slots__ = ('request_fields', 'err_msg')
+
     def __init__(self, request_fields=None):
         self.request_fields = request_fields
         self.err_msg = ''
-
-    def __getattr__(self, item):
-        return self.request_fields.get(item) or ''
+        for name in self.fields:
+            setattr(self, name, request_fields.get(name) or '')
 
     def is_valid(self):
         return all(self.field_is_correct(fn, fo) for fn, fo in self.fields.items())
@@ -173,6 +193,11 @@ class ClientsInterestsRequest(BaseRequest):
         ctx['nclients'] = len(self.client_ids)
 
 
+PAIR_FIELDS = (("phone", "email"),
+               ("first_name", "last_name"),
+               ("gender", "birthday"))
+
+
 class OnlineScoreRequest(BaseRequest):
     phone = PhoneField(required=False, nullable=True)
     email = EmailField(required=False, nullable=True)
@@ -186,13 +211,11 @@ class OnlineScoreRequest(BaseRequest):
 
     def set_context(self, ctx):
         has = [field for field in self.fields if self.request_fields.get(field) is not None]
-        logging.info(f'Получены поля {has}')
+        logging.info('Получены поля %s', has)
         ctx['has'] = has
 
     def valid_pair_fields(self):
-        for field1, field2 in [("phone", "email"),
-                               ("first_name", "last_name"),
-                               ("gender", "birthday")]:
+        for field1, field2 in PAIR_FIELDS:
             if self.request_fields.get(field1) is not None and self.request_fields.get(field2) is not None:
                 return True
 
@@ -211,38 +234,98 @@ class MethodRequest(BaseRequest):
         return self.login == ADMIN_LOGIN
 
 
+def get_admin_token():
+    return hashlib.sha512((datetime.datetime.now().strftime("%Y%m%d%H") + ADMIN_SALT).encode()).hexdigest()
+
+
+def get_user_token(account, login):
+    return hashlib.sha512((account + login + SALT).encode()).hexdigest()
+
+
 def check_auth(request):
     if request.is_admin:
-        digest = hashlib.sha512((datetime.datetime.now().strftime("%Y%m%d%H") + ADMIN_SALT).encode()).hexdigest()
+        digest = get_admin_token()
     else:
-        digest = hashlib.sha512((request.account + request.login + SALT).encode()).hexdigest()
+        digest = get_user_token(request.account, request.login)
 
     if digest == request.token:
         return True
     return False
 
 
-def online_score_handler(request, store):
+def rate_limit_key(request):
+    """Ключ корзины лимита запросов: (account, login) только для запросов с верным токеном,
+    иначе чужую корзину можно было бы исчерпать, подставив имя партнера.
+    Все остальные запросы, включая невалидные, делят общую корзину с ключом None"""
+    if not isinstance(request, dict):
+        return None
+    account, login, token = request.get("account") or "", request.get("login"), request.get("token")
+    if not all(isinstance(value, str) for value in (account, login, token)):
+        return None
+    digest = get_admin_token() if login == ADMIN_LOGIN else get_user_token(account, login)
+    return (account, login) if token == digest else None
+
+
+def online_score_handler(request, ctx, store):
     return {'score': get_score(store=store,
                                phone=request.phone,
                                email=request.email,
                                birthday=datetime.datetime.strptime(request.birthday, "%d.%m.%Y"),
                                gender=request.gender,
                                first_name=request.first_name,
-                               last_name=request.last_name)}, OK
+                               last_name=request.last_name,
+                               deadline=ctx.get('deadline'))}, OK
+
+
+def interests_etag(client_ids, date, versions):
+    return hashlib.md5(json.dumps([client_ids, date, versions]).encode()).hexdigest()
+
+
+def etag_matches(if_none_match, etag):
+    if not if_none_match:
+        return False
+    tags = [tag.strip() for tag in if_none_match.split(',')]
+    return '*' in tags or any(tag.removeprefix('W/').strip('"') == etag for tag in tags)
+
+
+def clients_interests_handler(request, ctx, store):
+    deadline = ctx.get('deadline')
+    client_ids = sorted(set(request.client_ids))
+    # "1.7.2017" и "01.07.2017" - одна дата, поэтому в etag и ключ кэша входит ее порядковый номер
+    date = datetime.datetime.strptime(request.date, "%d.%m.%Y").date() if request.date else None
+    day = date.toordinal() if date else None
+    # etag строится по версиям интересов, сами интересы для него не запрашиваются
+    versions = get_interests_versions(store, client_ids, deadline=deadline)
+    etag = interests_etag(client_ids, day, versions)
+    ctx['etag'] = etag
+    if etag_matches(ctx.get('if_none_match'), etag):
+        return {}, NOT_MODIFIED
+
+    # кэш результатов: (client_ids, дата) -> (etag, ответ), передается обработчику через контекст
+    interests_cache = ctx.get('interests_cache')
+    cache_key = (tuple(client_ids), day)
+    if interests_cache is not None:
+        cached = interests_cache.get(cache_key)
+        if cached is not None and cached[0] == etag:
+            return cached[1], OK
+
+    if date:
+        response = get_interests_as_of(store, client_ids, date, deadline=deadline)
+    else:
+        # интересы читаются по тем же версиям, что и etag, чтобы ответ не оказался старше него
+        response = get_interests_many(store, client_ids, versions, deadline=deadline)
+    if interests_cache is not None:
+        interests_cache.set(cache_key, (etag, response))
+    return response, OK
 
 
-def clients_interests_handler(request, store):
-    return {cid: get_interests(store, cid) for cid in request.client_ids}, OK
+METHODS = {
+    'online_score': (OnlineScoreRequest, online_score_handler),
+    'clients_interests': (ClientsInterestsRequest, clients_interests_handler),
+}
 
 
 def method_handler(request, ctx, store):
-    requests = {'online_score': OnlineScoreRequest,
-                'clients_interests': ClientsInterestsRequest}
-
-    methods = {'online_score': online_score_handler,
-               'clients_interests': clients_interests_handler}
-
     body, headers = request['body'], request['headers']
     mr = MethodRequest(body)
     if not mr.is_valid():
@@ -252,8 +335,8 @@ def method_handler(request, ctx, store):
         logging.info('Bad auth')
         return ERRORS[FORBIDDEN], FORBIDDEN
 
-    request = requests[body['method']](request_fields=body['arguments'])
-    method = methods[body['method']]
+    request_class, method = METHODS[body['method']]
+    request = request_class(request_fields=body['arguments'])
 
     if not request.is_valid():
         return request.err_msg, INVALID_REQUEST
@@ -261,8 +344,10 @@ def method_handler(request, ctx, store):
     if mr.is_admin:
         return {'score': 42}, OK
 
+    if headers.get('If-None-Match'):
+        ctx['if_none_match'] = headers['If-None-Match']
     request.set_context(ctx)
-    return method(request, store)
+    return method(request, ctx, store)
 
 
 class MainHTTPHandler(BaseHTTPRequestHandler):
@@ -270,56 +355,237 @@ class MainHTTPHandler(BaseHTTPRequestHandler):
         "method": method_handler
     }
     store = None
+    limiter = None
+    warmer = None
+    profiler = None
+    compressor = None
+    recorder = None
+    interests_cache = None
+    request_body = None
+    request_timeout = 10
 
     def get_request_id(self, headers):
         return headers.get('HTTP_X_REQUEST_ID', uuid.uuid4().hex)
 
+    def get_request_timeout(self, headers):
+        """клиент может только сократить время обработки запроса относительно заданного на сервере"""
+        try:
+            timeout = float(headers.get('X-Request-Timeout', self.request_timeout))
+        except ValueError:
+            return self.request_timeout
+        return min(timeout, self.request_timeout) if timeout > 0 else self.request_timeout
+
     def do_POST(self):
-        response, code = {}, OK
+        started = time.time()
+        context = {"request_id": self.get_request_id(self.headers),
+                   "deadline": time.monotonic() + self.get_request_timeout(self.headers)}
+        if self.interests_cache is not None:
+            context["interests_cache"] = self.interests_cache
+        self.request_body = None
+        if self.limiter is None:
+            response, code = self.handle_request(context)
+        elif not self.limiter.acquire():
+            logging.info("Превышен лимит одновременных запросов %s" % context["request_id"])
+            response, code = {}, SERVICE_UNAVAILABLE
+        else:
+            try:
+                response, code = self.handle_request(context)
+            finally:
+                self.limiter.release()
+        # кэш нужен только обработчику и в лог запроса не пишется
+        context.pop("interests_cache", None)
+        self.write_response(response, code, context)
+        if self.recorder is not None:
+            self.recorder.record(started, self.path, context["request_id"], self.request_body, code, response,
+                                 self.headers)
+
+    def do_GET(self):
+        """health check: 503, пока не завершен прогрев кэша"""
         context = {"request_id": self.get_request_id(self.headers)}
+        if self.path.strip("/") != "health":
+            self.write_response({}, NOT_FOUND, context)
+        elif self.warmer is None:
+            self.write_response({"ready": True}, OK, context)
+        else:
+            status = self.warmer.status()
+            self.write_response(status, OK if status["ready"] else SERVICE_UNAVAILABLE, context)
+
+    def write_response(self, response, code, context):
+        if code not in ERRORS:
+            r = {"response": response, "code": code}
+        else:
+            r = {"error": response or ERRORS.get(code, "Unknown Error"), "code": code}
+        # ответ 304 отправляется без тела
+        data = json.dumps(r).encode() if code != NOT_MODIFIED else b""
+        encoding = None
+        if self.compressor is not None and data:
+            start = time.perf_counter()
+            data, encoding = self.compressor.compress(data, self.headers.get("Accept-Encoding"))
+            if encoding:
+                context.setdefault("timings", {})["compress"] = round((time.perf_counter() - start) * 1000, 3)
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        if code != NOT_MODIFIED:
+            self.send_header("Content-Length", str(len(data)))
+        if "etag" in context:
+            self.send_header("ETag", '"%s"' % context["etag"])
+        if self.compressor is not None:
+            self.send_header("Vary", "Accept-Encoding")
+        if encoding:
+            self.send_header("Content-Encoding", encoding)
+        self.end_headers()
+        context.update(r)
+        logging.info(context)
+        self.wfile.write(data)
+
+    def handle_request(self, context):
+        if self.profiler is not None and self.is_profiled():
+            return self.profiler.run(context["request_id"], self.process_request, context)
+        return self.process_request(context)
+
+    def is_profiled(self):
+        """профилируется доля запросов или запрос администратора с заголовком X-Profile-Token"""
+        token = self.headers.get('X-Profile-Token')
+        return self.profiler.sampled() or (token is not None and token == get_admin_token())
+
+    def process_request(self, context):
+        response, code = {}, OK
         request = None
         try:
             data_string = self.rfile.read(int(self.headers['Content-Length']))
-            request = json.loads(data_string)
+            if self.headers.get('Content-Encoding'):
+                start = time.perf_counter()
+                data_string = decompress(data_string, self.headers['Content-Encoding'])
+                context.setdefault("timings", {})["decompress"] = round((time.perf_counter() - start) * 1000, 3)
+            request = self.request_body = json.loads(data_string)
         except:
             code = BAD_REQUEST
 
         if request:
             path = self.path.strip("/")
             logging.info("%s: %s %s" % (self.path, data_string, context["request_id"]))
-            if path in self.router:
+            if not self.is_allowed(request):
+                logging.info("Превышен лимит запросов для аккаунта %s" % context["request_id"])
+                code = TOO_MANY_REQUESTS
+            elif path in self.router:
                 try:
                     response, code = self.router[path]({"body": request, "headers": self.headers}, context, self.store)
+                except DeadlineExceeded:
+                    logging.info("Истекло время обработки запроса %s" % context["request_id"])
+                    code = GATEWAY_TIMEOUT
                 except Exception as e:
                     logging.exception("Unexpected error: %s" % e)
                     code = INTERNAL_ERROR
             else:
                 code = NOT_FOUND
+        return response, code
 
-        self.send_response(code)
-        self.send_header("Content-Type", "application/json")
-        self.end_headers()
-        if code not in ERRORS:
-            r = {"response": response, "code": code}
-        else:
-            r = {"error": response or ERRORS.get(code, "Unknown Error"), "code": code}
-        context.update(r)
-        logging.info(context)
-        self.wfile.write(json.dumps(r))
-        return
+    def is_allowed(self, request):
+        if self.limiter is None:
+            return True
+        return self.limiter.allow(rate_limit_key(request))
 
 
 if __name__ == "__main__":
     op = OptionParser()
     op.add_option("-p", "--port", action="store", type=int, default=8080)
     op.add_option("-l", "--log", action="store", default=None)
+    op.add_option("--no-tcp", action="store_true", default=False,
+                  help="не слушать TCP порт, только unix socket")
+    op.add_option("--unix-socket", action="store", default=None,
+                  help="путь к unix domain socket, который сервер слушает дополнительно к TCP порту")
+    op.add_option("--unix-socket-mode", action="store", default=None,
+                  help="права на файл unix socket в восьмеричном виде, например 660")
+    op.add_option("--redis-host", action="store", default="localhost")
+    op.add_option("--redis-port", action="store", type=int, default=6379)
+    op.add_option("--redis-socket", action="store", default=None,
+                  help="путь к unix socket redis, при указании используется вместо хоста и порта")
+    op.add_option("--rate", action="store", type=float, default=0,
+                  help="лимит запросов в секунду для пары account/login, 0 - без ограничений")
+    op.add_option("--burst", action="store", type=int, default=0,
+                  help="допустимый всплеск запросов для пары account/login")
+    op.add_option("--max-inflight", action="store", type=int, default=0,
+                  help="максимум одновременно обрабатываемых запросов, 0 - без ограничений")
+    op.add_option("--timeout", action="store", type=float, default=MainHTTPHandler.request_timeout,
+                  help="время на обработку запроса в секундах, клиент может сократить его заголовком X-Request-Timeout")
+    op.add_option("--warmup-keys", action="store", default=None,
+                  help="файл с ключами хранилища для прогрева кэша, по одному на строку")
+    op.add_option("--warmup-log", action="store", default=None,
+                  help="лог запросов api, по которому выбираются самые горячие ключи для прогрева")
+    op.add_option("--warmup-limit", action="store", type=int, default=1000)
+    op.add_option("--warmup-concurrency", action="store", type=int, default=8)
+    op.add_option("--profile-dir", action="store", default=None,
+                  help="каталог для профилей запросов в формате collapsed stacks, профилирование отключено по умолчанию")
+    op.add_option("--profile-rate", action="store", type=float, default=0,
+                  help="доля профилируемых запросов, остальные профилируются по заголовку X-Profile-Token")
+    op.add_option("--profile-interval", action="store", type=float, default=0.001,
+                  help="интервал между снимками стека профилируемого запроса в секундах")
+    op.add_option("--compress-min-size", action="store", type=int, default=1024,
+                  help="минимальный размер ответа в байтах для сжатия, 0 - сжатие отключено")
+    op.add_option("--gzip-level", action="store", type=int, default=6)
+    op.add_option("--brotli-level", action="store", type=int, default=5)
+    op.add_option("--zstd-level", action="store", type=int, default=3)
+    op.add_option("--interests-cache-size", action="store", type=int, default=0,
+                  help="число результатов clients_interests в кэше процесса, 0 - кэш отключен")
+    op.add_option("--interests-cache-ttl", action="store", type=float, default=600)
+    op.add_option("--capture", action="store", default=None,
+                  help="файл для записи запросов и ответов для replay.py, с расширением .gz - сжатый")
+    op.add_option("--local-cache-size", action="store", type=int, default=10000)
+    op.add_option("--local-cache-ttl", action="store", type=float, default=0,
+                  help="время жизни ключей в кэше процесса в секундах, 0 - кэш отключен, прогрев без него невозможен")
     (opts, args) = op.parse_args()
+    if opts.no_tcp and not opts.unix_socket:
+        op.error("--no-tcp требует --unix-socket")
+    # прогрев загружает ключи в кэш процесса, без него /health сообщал бы о готовности непрогретого сервера
+    if (opts.warmup_keys or opts.warmup_log) and not opts.local_cache_ttl:
+        op.error("--warmup-keys и --warmup-log требуют --local-cache-ttl")
     logging.basicConfig(filename=opts.log, level=logging.INFO,
                         format='[%(asctime)s] %(levelname).1s %(message)s', datefmt='%Y.%m.%d %H:%M:%S')
-    server = HTTPServer(("localhost", opts.port), MainHTTPHandler)
-    logging.info("Starting server at %s" % opts.port)
+    if opts.rate or opts.max_inflight:
+        MainHTTPHandler.limiter = RateLimiter(rate=opts.rate, burst=opts.burst, max_inflight=opts.max_inflight)
+    if opts.profile_dir:
+        MainHTTPHandler.profiler = RequestProfiler(opts.profile_dir, opts.profile_rate,
+                                                   opts.profile_interval)
+    if opts.compress_min_size:
+        MainHTTPHandler.compressor = Compressor(opts.compress_min_size, {"gzip": opts.gzip_level,
+                                                                        "br": opts.brotli_level,
+                                                                        "zstd": opts.zstd_level})
+    if opts.interests_cache_size:
+        MainHTTPHandler.interests_cache = LocalCache(opts.interests_cache_size, opts.interests_cache_ttl)
+    if opts.capture:
+        MainHTTPHandler.recorder = TrafficRecorder(opts.capture)
+    local_cache = LocalCache(opts.local_cache_size, opts.local_cache_ttl) if opts.local_cache_ttl else None
+    MainHTTPHandler.store = Store(host=opts.redis_host, port=opts.redis_port, local_cache=local_cache,
+                                  unix_socket_path=opts.redis_socket)
+    if opts.warmup_keys or opts.warmup_log:
+        keys = load_keys(opts.warmup_keys) if opts.warmup_keys else []
+        if opts.warmup_log:
+            keys += hot_keys_from_log(opts.warmup_log, opts.warmup_limit)
+        keys = list(dict.fromkeys(keys))[:opts.warmup_limit]
+        MainHTTPHandler.warmer = CacheWarmer(MainHTTPHandler.store, keys, opts.warmup_concurrency)
+        MainHTTPHandler.warmer.start()
+    MainHTTPHandler.request_timeout = opts.timeout
+    servers = []
+    if not opts.no_tcp:
+        servers.append(ThreadingHTTPServer(("localhost", opts.port), MainHTTPHandler))
+        logging.info("Starting server at %s" % opts.port)
+    if opts.unix_socket:
+        mode = int(opts.unix_socket_mode, 8) if opts.unix_socket_mode else None
+        servers.append(UnixHTTPServer(opts.unix_socket, MainHTTPHandler, mode))
+        logging.info("Starting server at %s" % opts.unix_socket)
+    for server in servers[1:]:
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    def stop(signum, frame):
+        raise KeyboardInterrupt
+
+    # по SIGTERM сервер завершается так же, как по Ctrl+C, с закрытием файла записи трафика
+    signal.signal(signal.SIGTERM, stop)
     try:
-        server.serve_forever()
+        servers[0].serve_forever()
     except KeyboardInterrupt:
         pass
-    server.server_close()
+    for server in servers:
+        server.server_close()
+    if MainHTTPHandler.recorder is not None:
+        MainHTTPHandler.recorder.close()
@@ -0,0 +1,205 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Замер времени и памяти на запрос в method_handler без сети и redis,
+времени запроса к серверу и к redis через TCP и unix domain socket.
+
+Сравнение с базовой версией: python bench.py --rev <git ревизия>"""
+
+import hashlib
+import io
+import json
+import logging
+import os
+import shutil
+import subprocess
+import sys
+import tarfile
+import tempfile
+import threading
+import time
+import tracemalloc
+from http.client import HTTPConnection
+from http.server import ThreadingHTTPServer
+from optparse import OptionParser, SUPPRESS_HELP
+
+import api
+from store import Store
+from unixsocket import UnixHTTPServer, UnixHTTPConnection
+
+REQUESTS = {
+    'online_score': {"account": "horns&hoofs", "login": "h&f", "method": "online_score",
+                     "arguments": {"phone": "79175002040", "email": "stupnikov@otus.ru", "gender": 1,
+                                   "birthday": "01.01.2000", "first_name": "a", "last_name": "b"}},
+    'clients_interests': {"account": "horns&hoofs", "login": "h&f", "method": "clients_interests",
+                          "arguments": {"client_ids": [1, 2, 3, 4]}},
+}
+
+
+def run_baseline(rev, argv):
+    """Тот же замер для дерева из ревизии rev в отдельном процессе,
+    чтобы api.py импортировал scoring.py и store.py той же ревизии"""
+    root = os.path.dirname(os.path.abspath(__file__))
+    archive = subprocess.run(['git', 'archive', rev], check=True, capture_output=True, cwd=root).stdout
+    with tempfile.TemporaryDirectory() as directory:
+        with tarfile.open(fileobj=io.BytesIO(archive)) as tar:
+            tar.extractall(directory)
+        shutil.copy(os.path.join(root, 'bench.py'), directory)
+        # модули, которых нет в ревизии (unixsocket.py), берутся из текущего дерева
+        env = dict(os.environ, PYTHONPATH=root)
+        subprocess.run([sys.executable, os.path.join(directory, 'bench.py'), '--label', rev] + argv,
+                       check=True, env=env)
+
+
+class MemoryStore:
+    """Хранилище в памяти с интерфейсом store.Store"""
+    def __init__(self):
+        self.data = {"i:%s" % cid: json.dumps(["books", "music"]) for cid in range(1, 5)}
+
+    def get(self, key, deadline=None):
+        return self.data.get(key)
+
+    def get_many(self, keys, deadline=None):
+        return [self.data.get(key) for key in keys]
+
+    def get_versioned_many(self, keys, versions, deadline=None):
+        return self.get_many(keys)
+
+    def cache_get(self, key, deadline=None):
+        return self.data.get(key)
+
+    def cache_set(self, key, value, ttl, deadline=None):
+        self.data[key] = value
+
+
+def sign(request):
+    msg = request["account"] + request["login"] + api.SALT
+    request["token"] = hashlib.sha512(msg.encode()).hexdigest()
+    return request
+
+
+def count_blocks(func, count):
+    """Число блоков памяти и байт, прибавившихся за count вызовов func, в пересчете на один вызов"""
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    func(count)
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    stats = after.compare_to(before, 'filename')
+    return sum(stat.count_diff for stat in stats) / count, sum(stat.size_diff for stat in stats) / count
+
+
+def peak_bytes(func, count):
+    """Средний за count вызовов func пик памяти сверх занятой до вызова, в байтах.
+
+    Снимки видят только то, что осталось после вызова, а временные словари и списки
+    освобождаются до его конца, поэтому они учитываются по пику внутри каждого вызова.
+    """
+    tracemalloc.start()
+    total = 0
+    for _ in range(count):
+        tracemalloc.reset_peak()
+        current, _ = tracemalloc.get_traced_memory()
+        func()
+        total += tracemalloc.get_traced_memory()[1] - current
+    tracemalloc.stop()
+    return total / count
+
+
+def bench(name, count, label=''):
+    store = MemoryStore()
+    body = sign(dict(REQUESTS[name]))
+    request = {"body": body, "headers": {}}
+    request_class = {'online_score': api.OnlineScoreRequest, 'clients_interests': api.ClientsInterestsRequest}[name]
+
+    def handle():
+        api.method_handler(request, {}, store)
+
+    started = time.perf_counter()
+    for _ in range(count):
+        handle()
+    elapsed = time.perf_counter() - started
+
+    objects = []
+
+    def build(n):
+        # объекты запроса удерживаются, чтобы посчитать занимаемые ими блоки
+        for _ in range(n):
+            objects.append((api.MethodRequest(body), request_class(request_fields=body['arguments'])))
+
+    peak = peak_bytes(handle, count)
+    blocks, size = count_blocks(build, count)
+    print(f'{label}{name}: {elapsed / count * 1e6:.2f} мкс/запрос, пик памяти за вызов {peak:.0f} байт, '
+          f'объекты запроса {blocks:.1f} блоков/{size:.0f} байт')
+
+
+class QuietHandler(api.MainHTTPHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+def bench_http(name, count):
+    QuietHandler.store = MemoryStore()
+    body = json.dumps(sign(REQUESTS[name])).encode()
+    directory = tempfile.mkdtemp()
+    tcp = ThreadingHTTPServer(("localhost", 0), QuietHandler)
+    unix = UnixHTTPServer(os.path.join(directory, 'api.sock'), QuietHandler)
+    connections = {'tcp': lambda: HTTPConnection('localhost', tcp.server_port),
+                   'unix': lambda: UnixHTTPConnection(unix.server_address)}
+    for server in (tcp, unix):
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        for transport, connect in connections.items():
+            started = time.perf_counter()
+            for _ in range(count):
+                # сервер работает по HTTP/1.0, на каждый запрос новое соединение
+                conn = connect()
+                conn.request('POST', '/method/', body, {'Content-Type': 'application/json'})
+                conn.getresponse().read()
+                conn.close()
+            elapsed = time.perf_counter() - started
+            print(f'{name} через {transport}: {elapsed / count * 1e6:.2f} мкс/запрос')
+    finally:
+        for server in (tcp, unix):
+            server.shutdown()
+            server.server_close()
+        os.rmdir(directory)
+
+
+def bench_redis(count, stores):
+    for transport, store in stores.items():
+        store.cache_set('bench', 1, 60)
+        started = time.perf_counter()
+        for _ in range(count):
+            store.fetch('bench')
+        elapsed = time.perf_counter() - started
+        print(f'Store.get через {transport}: {elapsed / count * 1e6:.2f} мкс/запрос')
+
+
+if __name__ == "__main__":
+    op = OptionParser()
+    op.add_option("-n", "--count", action="store", type=int, default=20000)
+    op.add_option("--rev", action="store", default=None,
+                  help="сначала выполнить те же замеры для указанной git ревизии, например базовой")
+    op.add_option("--label", action="store", default=None, help=SUPPRESS_HELP)
+    op.add_option("--http", action="store_true", default=False,
+                  help="замерить запросы к серверу через TCP и unix socket")
+    op.add_option("--redis", action="store_true", default=False,
+                  help="замерить Store.get через TCP и, если указан --redis-socket, через unix socket")
+    op.add_option("--redis-host", action="store", default="localhost")
+    op.add_option("--redis-port", action="store", type=int, default=6379)
+    op.add_option("--redis-socket", action="store", default=None)
+    (opts, args) = op.parse_args()
+    logging.disable(logging.CRITICAL)
+    if opts.rev:
+        # сервер базовой версии пишет в сокет str, поэтому HTTP замеры только для текущего дерева
+        run_baseline(opts.rev, ['-n', str(opts.count)] + args)
+    label = f'[{opts.label}] ' if opts.label else ''
+    for name in args or REQUESTS:
+        bench(name, opts.count, label)
+        if opts.http:
+            bench_http(name, opts.count)
+    if opts.redis:
+        stores = {'tcp': Store(host=opts.redis_host, port=opts.redis_port)}
+        if opts.redis_socket:
+            stores['unix'] = Store(unix_socket_path=opts.redis_socket)
+        bench_redis(opts.count, stores)
@@ -0,0 +1,52 @@
+import gzip
+import json
+import threading
+import time
+
+# заголовки запроса, от которых зависит ответ api, записываются и воспроизводятся вместе с телом
+CAPTURED_HEADERS = ('If-None-Match', 'X-Request-Timeout', 'Accept-Encoding')
+
+
+def open_capture(path, mode='rt'):
+    if path.endswith('.gz'):
+        return gzip.open(path, mode, encoding='utf-8')
+    return open(path, mode, encoding='utf-8')
+
+
+def read_capture(path):
+    with open_capture(path) as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+class TrafficRecorder:
+    """Запись запросов и ответов api в JSON lines (сжатые gzip для файлов .gz) для последующего воспроизведения"""
+    def __init__(self, path, flush_interval=1.0):
+        self.path = path
+        self.file = open_capture(path, 'at')
+        # сжатый файл сбрасывается не чаще раза в flush_interval секунд, иначе каждая запись сжимается отдельно
+        self.flush_interval = flush_interval if path.endswith('.gz') else 0
+        self.flushed = time.monotonic()
+        self.lock = threading.Lock()
+
+    def record(self, started, path, request_id, body, code, response, headers=None):
+        if isinstance(body, dict):
+            # токены партнеров не записываются, replay.py подписывает запросы заново
+            body = {key: value for key, value in body.items() if key != 'token'}
+        item = {'t': round(started, 6), 'path': path, 'id': request_id,
+                'body': body, 'code': code, 'response': response}
+        headers = {name: headers[name] for name in CAPTURED_HEADERS if headers and headers.get(name)}
+        if headers:
+            item['headers'] = headers
+        line = json.dumps(item, separators=(',', ':'), ensure_ascii=False)
+        with self.lock:
+            self.file.write(line + '\n')
+            now = time.monotonic()
+            if now - self.flushed >= self.flush_interval:
+                self.file.flush()
+                self.flushed = now
+
+    def close(self):
+        with self.lock:
+            self.file.close()
@@ -0,0 +1,98 @@
+import gzip
+import zlib
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# предпочтения сервера при равном приоритете у клиента
+PREFERRED = ['zstd', 'br', 'gzip']
+DEFAULT_LEVELS = {'gzip': 6, 'br': 5, 'zstd': 3}
+MAX_BODY_SIZE = 10 * 1024 * 1024
+
+
+def available_encodings():
+    encodings = ['gzip']
+    if brotli is not None:
+        encodings.append('br')
+    if zstandard is not None:
+        encodings.append('zstd')
+    return encodings
+
+
+def parse_accept_encoding(header):
+    """Значения q из заголовка Accept-Encoding по кодировкам"""
+    weights = {}
+    for part in (header or '').split(','):
+        coding, _, params = part.strip().partition(';')
+        coding = coding.strip().lower()
+        if not coding:
+            continue
+        q = 1.0
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        weights[coding] = q
+    return weights
+
+
+def negotiate(header, encodings):
+    weights = parse_accept_encoding(header)
+    candidates = [(weights.get(e, weights.get('*', 0.0)), -PREFERRED.index(e), e) for e in encodings]
+    candidates = [c for c in candidates if c[0] > 0]
+    return max(candidates)[2] if candidates else None
+
+
+def decompress(data, encoding, max_size=MAX_BODY_SIZE):
+    """Распаковка тела запроса по Content-Encoding, не более max_size байт"""
+    encoding = (encoding or 'identity').strip().lower()
+    if encoding == 'identity':
+        return data
+    if encoding in ('gzip', 'x-gzip'):
+        decompressor = zlib.decompressobj(wbits=16 + zlib.MAX_WBITS)
+        result = decompressor.decompress(data, max_size)
+        if decompressor.unconsumed_tail:
+            raise ValueError(f'Тело запроса больше {max_size} байт')
+        return result
+    if encoding == 'br' and brotli is not None:
+        # распаковка останавливается, когда выход достигает лимита, а не после распаковки всего тела
+        decompressor = brotli.Decompressor()
+        result = decompressor.process(data, output_buffer_limit=max_size + 1)
+        if len(result) <= max_size and not decompressor.is_finished():
+            raise ValueError('Тело запроса в кодировке br обрезано')
+    elif encoding == 'zstd' and zstandard is not None:
+        result = zstandard.ZstdDecompressor().decompress(data, max_output_size=max_size)
+    else:
+        raise ValueError(f'Неподдерживаемая кодировка тела запроса "{encoding}"')
+    if len(result) > max_size:
+        raise ValueError(f'Тело запроса больше {max_size} байт')
+    return result
+
+
+class Compressor:
+    """Сжатие ответов размером от min_size байт в кодировке, выбранной по Accept-Encoding"""
+    def __init__(self, min_size=1024, levels=None):
+        self.min_size = min_size
+        self.levels = dict(DEFAULT_LEVELS, **(levels or {}))
+        self.encodings = available_encodings()
+
+    def compress(self, data, accept_encoding):
+        if len(data) < self.min_size or not accept_encoding:
+            return data, None
+        encoding = negotiate(accept_encoding, self.encodings)
+        if encoding == 'gzip':
+            return gzip.compress(data, compresslevel=self.levels['gzip']), encoding
+        if encoding == 'br':
+            return brotli.compress(data, quality=self.levels['br']), encoding
+        if encoding == 'zstd':
+            return zstandard.ZstdCompressor(level=self.levels['zstd']).compress(data), encoding
+        return data, None
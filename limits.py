@@ -0,0 +1,69 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class TokenBucket:
+    """Корзина токенов: rate токенов в секунду, не более capacity накопленных"""
+    __slots__ = ('rate', 'capacity', 'tokens', 'updated')
+
+    def __init__(self, rate, capacity, now):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = now
+
+    def consume(self, now, amount=1):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens < amount:
+            return False
+        self.tokens -= amount
+        return True
+
+
+class RateLimiter:
+    """Контроль допуска запросов в пределах одного процесса.
+
+    rate/burst - лимит запросов в секунду и размер всплеска для одного ключа (см. api.rate_limit_key),
+    max_inflight - ограничение на число одновременно обрабатываемых запросов.
+    Нулевое или пустое значение отключает соответствующую проверку.
+    """
+    def __init__(self, rate=None, burst=None, max_inflight=None, max_buckets=10000):
+        self.rate = rate
+        self.burst = burst or max(rate or 0, 1)
+        self.max_inflight = max_inflight
+        self.max_buckets = max_buckets
+        self.buckets = OrderedDict()
+        self.inflight = 0
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        if not self.max_inflight:
+            return True
+        with self.lock:
+            if self.inflight >= self.max_inflight:
+                return False
+            self.inflight += 1
+            return True
+
+    def release(self):
+        if not self.max_inflight:
+            return
+        with self.lock:
+            self.inflight -= 1
+
+    def allow(self, key, now=None):
+        if not self.rate:
+            return True
+        now = time.monotonic() if now is None else now
+        with self.lock:
+            bucket = self.buckets.get(key)
+            if bucket is None:
+                bucket = self.buckets[key] = TokenBucket(self.rate, self.burst, now)
+                # храним ограниченное число корзин, вытесняя давно не использовавшиеся
+                if len(self.buckets) > self.max_buckets:
+                    self.buckets.popitem(last=False)
+            else:
+                self.buckets.move_to_end(key)
+            return bucket.consume(now)
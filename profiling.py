@@ -0,0 +1,86 @@
+import logging
+import os
+import random
+import sys
+import threading
+import time
+from collections import Counter
+
+
+def frame_name(frame):
+    code = frame.f_code
+    return f"{frame.f_globals.get('__name__', '?')}.{getattr(code, 'co_qualname', code.co_name)}"
+
+
+class StackSampler:
+    """Сэмплирующий профайлер потока, в котором он запущен: отдельный поток раз в interval секунд
+    снимает его стек через sys._current_frames(), сам профилируемый код не замедляется.
+
+    Результат - словарь "a;b;c" -> число снимков, формат collapsed stacks для flamegraph.pl/speedscope.
+    Пока профилируемый поток занят python кодом, сэмплер получает GIL не чаще sys.getswitchinterval(),
+    поэтому короткий запрос дает единицы снимков: профили многих запросов складываются конкатенацией файлов.
+    """
+    def __init__(self, interval=0.001):
+        self.interval = interval
+        self.stacks = Counter()
+        self.stopped = threading.Event()
+        self.thread = None
+        self.thread_id = None
+        self.root = None
+
+    def __enter__(self):
+        self.thread_id = threading.get_ident()
+        # стек выше вызывающей функции (цикл сервера) в результат не попадает
+        self.root = sys._getframe(1)
+        self.thread = threading.Thread(target=self.run, name='stack-sampler', daemon=True)
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stopped.set()
+        self.thread.join()
+        self.root = None
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            self.sample()
+
+    def sample(self):
+        frame = sys._current_frames().get(self.thread_id)
+        names = []
+        while frame is not None and frame is not self.root:
+            names.append(frame_name(frame))
+            frame = frame.f_back
+        # снимок, сделанный вне профилируемого кода или уже в __exit__, не учитывается
+        if names and frame is self.root and not self.stopped.is_set():
+            self.stacks[';'.join(reversed(names))] += 1
+
+    def collapsed(self):
+        return ''.join(f'{stack} {value}\n' for stack, value in self.stacks.items())
+
+
+class RequestProfiler:
+    """Профилирование выбранных запросов с записью collapsed stacks в output_dir"""
+    def __init__(self, output_dir, sample_rate=0.0, interval=0.001):
+        self.output_dir = output_dir
+        self.sample_rate = sample_rate
+        self.interval = interval
+        os.makedirs(output_dir, exist_ok=True)
+
+    def sampled(self):
+        return self.sample_rate > 0 and random.random() < self.sample_rate
+
+    def run(self, request_id, func, *args):
+        with StackSampler(self.interval) as profiler:
+            result = func(*args)
+        self.write(request_id, profiler)
+        return result
+
+    def write(self, request_id, profiler):
+        path = os.path.join(self.output_dir, f'{int(time.time())}-{request_id}.folded')
+        try:
+            with open(path, 'w') as f:
+                f.write(profiler.collapsed())
+            logging.info(f'Профиль запроса {request_id} записан в {path}')
+        except OSError as err:
+            logging.error(f'Не удалось записать профиль запроса {request_id}: {err}')
@@ -0,0 +1,139 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Воспроизведение записанного api.py --capture трафика для нагрузочного тестирования"""
+
+import datetime
+import hashlib
+import json
+import math
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from http.client import HTTPConnection
+from optparse import OptionParser
+from urllib.parse import urlsplit
+
+from api import SALT, ADMIN_LOGIN, ADMIN_SALT
+from capture import read_capture
+from compression import decompress
+
+
+def sign(body, salt=SALT, admin_salt=ADMIN_SALT):
+    """Токен запроса для соли тестового сервера"""
+    body = dict(body)
+    if body.get('login') == ADMIN_LOGIN:
+        msg = datetime.datetime.now().strftime("%Y%m%d%H") + admin_salt
+    else:
+        msg = (body.get('account') or '') + (body.get('login') or '') + salt
+    body['token'] = hashlib.sha512(msg.encode()).hexdigest()
+    return body
+
+
+def percentile(values, p):
+    """Перцентиль p по ближайшему рангу для отсортированного списка"""
+    if not values:
+        return 0.0
+    rank = math.ceil(p / 100.0 * len(values))
+    return values[min(max(rank, 1), len(values)) - 1]
+
+
+class Replayer:
+    def __init__(self, url, speed=1.0, concurrency=8, salt=SALT, admin_salt=ADMIN_SALT, timeout=10):
+        parts = urlsplit(url)
+        self.host = parts.hostname
+        self.port = parts.port or 80
+        self.speed = speed
+        self.concurrency = concurrency
+        self.salt = salt
+        self.admin_salt = admin_salt
+        self.timeout = timeout
+        self.latencies = []
+        self.lags = []
+        self.codes = Counter()
+        self.diffs = []
+        self.lock = threading.Lock()
+
+    def send(self, record, scheduled=None):
+        """Отправка записанного запроса. Задержка считается от запланированного времени scheduled,
+        чтобы в нее вошло ожидание свободного потока, когда concurrency не хватает для записанной частоты"""
+        body = json.dumps(sign(record['body'], self.salt, self.admin_salt)).encode()
+        headers = dict(record.get('headers') or {}, **{'Content-Type': 'application/json'})
+        started = time.perf_counter()
+        try:
+            # сервер отвечает по HTTP/1.0 и закрывает соединение после ответа
+            conn = HTTPConnection(self.host, self.port, timeout=self.timeout)
+            conn.request('POST', record['path'], body, headers)
+            reply = conn.getresponse()
+            data = reply.read()
+            conn.close()
+            if data:
+                data = json.loads(decompress(data, reply.getheader('Content-Encoding')))
+                code = data.get('code')
+                response = data.get('response', data.get('error'))
+            else:
+                # у ответа 304 нет тела, код берется из статуса
+                code, response = reply.status, None
+        except (OSError, ValueError) as err:
+            code, response = type(err).__name__, None
+        finished = time.perf_counter()
+        with self.lock:
+            self.latencies.append(finished - (started if scheduled is None else scheduled))
+            if scheduled is not None:
+                self.lags.append(started - scheduled)
+            self.codes[code] += 1
+            if code != record['code'] or (code == 200 and response != record['response']):
+                self.diffs.append((record['id'], record['code'], code, record['response'], response))
+
+    def run(self, records):
+        records = [r for r in records if r.get('body')]
+        if not records:
+            return 0.0
+        first = records[0]['t']
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=self.concurrency) as pool:
+            for record in records:
+                if not self.speed:
+                    pool.submit(self.send, record)
+                    continue
+                scheduled = started + (record['t'] - first) / self.speed
+                delay = scheduled - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+                pool.submit(self.send, record, scheduled)
+        return time.perf_counter() - started
+
+    def report(self, elapsed, max_diffs=10):
+        latencies = sorted(self.latencies)
+        lines = [f'Запросов: {len(latencies)} за {elapsed:.2f} с ({len(latencies) / elapsed if elapsed else 0:.1f} rps)']
+        lines.append('Задержка, мс: ' + ', '.join(f'p{p}={percentile(latencies, p) * 1000:.2f}'
+                                                  for p in (50, 90, 99, 99.9)) +
+                     f', max={(latencies[-1] if latencies else 0) * 1000:.2f}')
+        if self.lags:
+            lags = sorted(self.lags)
+            lines.append('Отставание от расписания, мс: ' + ', '.join(f'p{p}={percentile(lags, p) * 1000:.2f}'
+                                                                     for p in (50, 99)) +
+                         f', max={lags[-1] * 1000:.2f}')
+        lines.append('Коды ответов: ' + ', '.join(f'{code}: {count}' for code, count in self.codes.most_common()))
+        lines.append(f'Расхождений с записью: {len(self.diffs)}')
+        for request_id, expected_code, code, expected, response in self.diffs[:max_diffs]:
+            lines.append(f'  {request_id}: {expected_code} {json.dumps(expected, ensure_ascii=False)} -> '
+                         f'{code} {json.dumps(response, ensure_ascii=False)}')
+        return '\n'.join(lines)
+
+
+if __name__ == "__main__":
+    op = OptionParser(usage="%prog [options] capture_file")
+    op.add_option("-u", "--url", action="store", default="http://127.0.0.1:8080")
+    op.add_option("-s", "--speed", action="store", type=float, default=1.0,
+                  help="множитель скорости относительно записи, 0 - без пауз между запросами")
+    op.add_option("-c", "--concurrency", action="store", type=int, default=8)
+    op.add_option("--salt", action="store", default=SALT)
+    op.add_option("--admin-salt", action="store", default=ADMIN_SALT)
+    op.add_option("--timeout", action="store", type=float, default=10)
+    (opts, args) = op.parse_args()
+    if len(args) != 1:
+        op.error("не указан файл с записью трафика")
+    replayer = Replayer(opts.url, opts.speed, opts.concurrency, opts.salt, opts.admin_salt, opts.timeout)
+    elapsed = replayer.run(read_capture(args[0]))
+    print(replayer.report(elapsed))
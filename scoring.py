@@ -1,18 +1,38 @@
+import datetime
 import hashlib
 import json
 
+# сколько дней хранится история интересов клиентов
+INTERESTS_RETENTION_DAYS = 365
 
-def get_score(store, phone, email, birthday=None, gender=None, first_name=None, last_name=None):
+
+def get_score_key(phone=None, birthday=None, first_name=None, last_name=None):
     key_parts = [
         first_name or "",
         last_name or "",
         phone or "",
         birthday.strftime("%Y%m%d") if birthday is not None else "",
     ]
-    key = "uid:" + hashlib.md5("".join(key_parts).encode()).hexdigest()
+    return "uid:" + hashlib.md5("".join(key_parts).encode()).hexdigest()
+
+
+def get_interests_key(cid):
+    return "i:%s" % cid
+
+
+def get_interests_version_key(cid):
+    return "iv:%s" % cid
+
+
+def get_interests_history_key(cid):
+    return "ih:%s" % cid
+
+
+def get_score(store, phone, email, birthday=None, gender=None, first_name=None, last_name=None, deadline=None):
+    key = get_score_key(phone, birthday, first_name, last_name)
     # try get from cache,
     # fallback to heavy calculation in case of cache miss
-    score = store.cache_get(key) or 0
+    score = store.cache_get(key, deadline=deadline) or 0
     if score:
         return score
     if phone:
@@ -24,10 +44,65 @@ def get_score(store, phone, email, birthday=None, gender=None, first_name=None,
     if first_name and last_name:
         score += 0.5
     # cache for 60 minutes
-    store.cache_set(key, score, 60 * 60)
+    store.cache_set(key, score, 60 * 60, deadline=deadline)
     return score
 
 
-def get_interests(store, cid):
-    r = store.get("i:%s" % cid)
-    return json.loads(r) if r else []
+def get_interests_many(store, cids, versions, deadline=None):
+    """Текущие интересы клиентов не старше версий versions, одним запросом к хранилищу"""
+    if not cids:
+        return {}
+    values = store.get_versioned_many([get_interests_key(cid) for cid in cids], versions, deadline=deadline)
+    return {cid: json.loads(r) if r else [] for cid, r in zip(cids, values)}
+
+
+def preload(store, key):
+    """Загрузка ключа в локальный кэш хранилища тем же путем, которым его читают обработчики"""
+    prefix, _, cid = key.partition(':')
+    if prefix == 'i' and cid:
+        get_interests_many(store, [cid], get_interests_versions(store, [cid]))
+    else:
+        store.get(key)
+
+
+def get_interests_as_of(store, cids, date, deadline=None):
+    """Интересы клиентов на дату date, одним запросом к хранилищу на весь список.
+    У клиентов без истории, записанных до ее появления, на сегодня и позже берутся текущие интересы"""
+    if not cids:
+        return {}
+    values = store.get_latest_many([get_interests_history_key(cid) for cid in cids], date.toordinal(),
+                                   deadline=deadline)
+    missing = [i for i, value in enumerate(values) if value is None]
+    if missing and date >= datetime.date.today():
+        current = store.get_many([get_interests_key(cids[i]) for i in missing], deadline=deadline)
+        for i, value in zip(missing, current):
+            values[i] = value
+    return {cid: json.loads(r) if r else [] for cid, r in zip(cids, values)}
+
+
+def get_interests_versions(store, cids, deadline=None):
+    """Номера версий интересов клиентов, одним запросом к хранилищу"""
+    if not cids:
+        return []
+    versions = store.get_many([get_interests_version_key(cid) for cid in cids], deadline=deadline)
+    return [int(v) if v else 0 for v in versions]
+
+
+def set_interests(store, cid, interests, date=None, retention_days=INTERESTS_RETENTION_DAYS, deadline=None):
+    """Запись интересов клиента на дату date (по умолчанию - сегодня) в историю.
+
+    Текущие интересы - последняя версия в истории не позже сегодняшнего дня: запись на будущую дату
+    их не меняет, а запись на прошлую дату меняет, только если более новых версий нет.
+    """
+    today = datetime.date.today()
+    date = date or today
+    value = json.dumps(interests)
+    history_key = get_interests_history_key(cid)
+    store.add_version(history_key, value, date.toordinal(),
+                      keep_after=(today - datetime.timedelta(days=retention_days)).toordinal(), deadline=deadline)
+    if date < today:
+        value = store.get_latest_many([history_key], today.toordinal(), deadline=deadline)[0]
+    if date <= today:
+        store.set(get_interests_key(cid), value, deadline=deadline)
+    # версия увеличивается после записи, чтобы закэшированный результат не пережил новые данные
+    return store.incr(get_interests_version_key(cid), deadline=deadline)
@@ -1,7 +1,12 @@
 import functools
 import logging
+import threading
+import time
+from collections import OrderedDict
 
 from redis import Redis
+from redis.backoff import NoBackoff
+from redis.retry import Retry
 from redis.exceptions import TimeoutError, ConnectionError
 
 
@@ -9,56 +14,190 @@ class RunTimeConnectionError(Exception):
     pass
 
 
+class DeadlineExceeded(Exception):
+    pass
+
+
+def remaining(deadline):
+    """Оставшееся до дедлайна время в секундах, None - если дедлайн не задан"""
+    if deadline is None:
+        return None
+    left = deadline - time.monotonic()
+    if left <= 0:
+        raise DeadlineExceeded('Истекло время обработки запроса.')
+    return left
+
+
 def redis_recall(max_retry_count):
     def decorator(func):
         @functools.wraps(func)
         def wrapper(*args, **kwargs):
             count = 0
             while count < max_retry_count:
+                # каждая попытка получает только остаток бюджета запроса
+                remaining(kwargs.get('deadline'))
                 try:
                     return func(*args, **kwargs)
                 except (TimeoutError, ConnectionError) as err:
                     logging.error(f'Ошибка при подключении к хранилищу: {err}')
                     count += 1
-                raise RunTimeConnectionError('Превышено число попыток подключения к хранилищу.')
+            raise RunTimeConnectionError('Превышено число попыток подключения к хранилищу.')
         return wrapper
     return decorator
 
 
+class LocalCache:
+    """Кэш в памяти процесса: не более maxsize ключей, каждый живет ttl секунд"""
+    def __init__(self, maxsize=10000, ttl=60):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.data = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key, now=None):
+        now = time.monotonic() if now is None else now
+        with self.lock:
+            item = self.data.get(key)
+            if item is None:
+                return None
+            value, expires = item
+            if expires <= now:
+                del self.data[key]
+                return None
+            self.data.move_to_end(key)
+            return value
+
+    def set(self, key, value, now=None):
+        now = time.monotonic() if now is None else now
+        with self.lock:
+            self.data[key] = (value, now + self.ttl)
+            self.data.move_to_end(key)
+            if len(self.data) > self.maxsize:
+                self.data.popitem(last=False)
+
+    def __len__(self):
+        return len(self.data)
+
+
 class Store:
-    def __init__(self, host='localhost', port='6379', db=0, socket_timeout=5):
+    def __init__(self, host='localhost', port='6379', db=0, socket_timeout=5, local_cache=None, unix_socket_path=None):
         self.host = host
         self.port = port
+        self.unix_socket_path = unix_socket_path
         self.db = db
         self.socket_timeout = socket_timeout
+        self.local_cache = local_cache
+
+    def get(self, key, deadline=None):
+        if self.local_cache is not None:
+            value = self.local_cache.get(key)
+            if value is not None:
+                return value
+        value = self.fetch(key, deadline=deadline)
+        if self.local_cache is not None and value is not None:
+            self.local_cache.set(key, value)
+        return value
 
     @redis_recall(3)
-    def get(self, key):
-        redis_client = self.get_redis_client()
+    def fetch(self, key, deadline=None):
+        redis_client = self.get_redis_client(deadline)
         value = redis_client.get(key)
         logging.info(f'Их хранилища redis по ключу "{key}" получено значение "{value}"')
         return value
 
-    def cache_get(self, key):
+    @redis_recall(3)
+    def get_many(self, keys, deadline=None):
+        redis_client = self.get_redis_client(deadline)
+        values = redis_client.mget(keys)
+        logging.info(f'Их хранилища redis по ключам {keys} получены значения {values}')
+        return values
+
+    def get_versioned_many(self, keys, versions, deadline=None):
+        """Значения ключей одним запросом к redis. В локальном кэше значение хранится вместе с версией
+        и не используется после ее смены, поэтому не может оказаться старше переданной версии"""
+        values = [None] * len(keys)
+        if self.local_cache is not None:
+            values = [self.local_cache.get((key, version)) for key, version in zip(keys, versions)]
+        missing = [i for i, value in enumerate(values) if value is None]
+        if missing:
+            fetched = self.get_many([keys[i] for i in missing], deadline=deadline)
+            for i, value in zip(missing, fetched):
+                values[i] = value
+                if self.local_cache is not None and value is not None:
+                    self.local_cache.set((keys[i], versions[i]), value)
+        return values
+
+    @redis_recall(3)
+    def set(self, key, value, deadline=None):
+        redis_client = self.get_redis_client(deadline)
+        redis_client.set(key, value)
+        if self.local_cache is not None:
+            self.local_cache.set(key, value)
+        logging.info(f'В хранилище redis записано значение "{value}" по ключу "{key}"')
+
+    @redis_recall(3)
+    def incr(self, key, deadline=None):
+        redis_client = self.get_redis_client(deadline)
+        return redis_client.incr(key)
+
+    @redis_recall(3)
+    def get_latest_many(self, keys, max_score, deadline=None):
+        """Для каждого отсортированного множества - значение с наибольшей оценкой не выше max_score"""
+        pipeline = self.get_redis_client(deadline).pipeline(transaction=False)
+        for key in keys:
+            pipeline.zrevrangebyscore(key, max_score, '-inf', start=0, num=1)
+        values = [members[0].partition(':')[2] if members else None for members in pipeline.execute()]
+        logging.info(f'Их хранилища redis по ключам {keys} на {max_score} получены значения {values}')
+        return values
+
+    @redis_recall(3)
+    def add_version(self, key, value, score, keep_after=None, deadline=None):
+        """Версия value с оценкой score в отсортированном множестве key.
+
+        Версии старше keep_after удаляются, кроме последней из них - она нужна для запросов на даты после keep_after.
+        """
+        redis_client = self.get_redis_client(deadline)
+        pipeline = redis_client.pipeline()
+        # значение уникально в пределах множества, поэтому оценка входит в него
+        pipeline.zremrangebyscore(key, score, score)
+        pipeline.zadd(key, {f'{score}:{value}': score})
+        pipeline.execute()
+        if keep_after is not None:
+            latest = redis_client.zrevrangebyscore(key, keep_after, '-inf', start=0, num=1, withscores=True)
+            if latest:
+                redis_client.zremrangebyscore(key, '-inf', f'({int(latest[0][1])}')
+        logging.info(f'В хранилище redis записано значение "{value}" по ключу "{key}" с оценкой {score}')
+
+    def cache_get(self, key, deadline=None):
         try:
-            return self.get(key)
+            return self.get(key, deadline=deadline)
+        except DeadlineExceeded:
+            raise
         except (RunTimeConnectionError, Exception) as err:
             logging.exception(err)
 
     @redis_recall(3)
-    def cache_set(self, key, score, ttl):
+    def cache_set(self, key, score, ttl, deadline=None):
         try:
-            redis_client = self.get_redis_client()
+            redis_client = self.get_redis_client(deadline)
             redis_client.set(key, score, ttl)
+            if self.local_cache is not None:
+                self.local_cache.set(key, score)
             logging.info(f'В хранилище redis записано значение "{score}" по ключу "{key}"')
         except RunTimeConnectionError as err:
             logging.error(err)
 
-    def get_redis_client(self):
+    def get_redis_client(self, deadline=None):
+        left = remaining(deadline)
+        socket_timeout = self.socket_timeout if left is None else min(self.socket_timeout, left)
         return Redis(host=self.host,
                      port=self.port,
+                     unix_socket_path=self.unix_socket_path,
                      db=self.db,
-                     socket_timeout=self.socket_timeout,
+                     socket_timeout=socket_timeout,
+                     socket_connect_timeout=socket_timeout,
+                     # повторные попытки делает redis_recall в пределах дедлайна, у клиента redis они отключены
+                     retry=Retry(NoBackoff(), 0),
                      decode_responses=True)
 
 
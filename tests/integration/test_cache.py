@@ -1,15 +1,37 @@
 import unittest
 import hashlib
 import datetime
+import time
+import socket
 from utils import cases
-from store import Store
+from store import Store, LocalCache, DeadlineExceeded
+from scoring import set_interests, preload
 import api
 
 
 class MockStore(Store):
-    def get(self, key):
+    def get(self, key, deadline=None):
         raise Exception('Не удалось получить данные из хранилища')
 
+    def get_many(self, keys, deadline=None):
+        raise Exception('Не удалось получить данные из хранилища')
+
+    def get_latest_many(self, keys, max_score, deadline=None):
+        raise Exception('Не удалось получить данные из хранилища')
+
+
+class CountingStore(Store):
+    """Хранилище, которое считает запросы за самими интересами"""
+    reads = 0
+
+    def get_versioned_many(self, keys, versions, deadline=None):
+        self.reads += 1
+        return super().get_versioned_many(keys, versions, deadline=deadline)
+
+    def get_latest_many(self, keys, max_score, deadline=None):
+        self.reads += 1
+        return super().get_latest_many(keys, max_score, deadline=deadline)
+
 
 class TestSuite(unittest.TestCase):
     def setUp(self):
@@ -75,6 +97,202 @@ class TestSuite(unittest.TestCase):
         with self.assertRaises(Exception):
             self.get_response(request)
 
+    @cases([
+        {"client_ids": [1, 2], "date": "19.07.2017"},
+    ])
+    def test_interests_deadline_exceeded(self, arguments):
+        request = {"account": "horns&hoofs", "login": "h&f", "method": "clients_interests", "arguments": arguments}
+        self.context = {"deadline": time.monotonic() - 1}
+
+        self.set_valid_auth(request)
+        with self.assertRaises(DeadlineExceeded):
+            self.get_response(request)
+
+    def test_deadline_with_unresponsive_store(self):
+        # сервер принимает соединения, но не отвечает
+        server = socket.socket()
+        server.bind(('127.0.0.1', 0))
+        server.listen(10)
+        self.addCleanup(server.close)
+        store = Store(host='127.0.0.1', port=server.getsockname()[1])
+
+        started = time.monotonic()
+        with self.assertRaises(DeadlineExceeded):
+            store.get('i:1', deadline=started + 0.5)
+        self.assertLess(time.monotonic() - started, 1)
+
+    @cases([
+        {"client_ids": [1, 2]},
+    ])
+    def test_interests_not_modified(self, arguments):
+        request = {"account": "horns&hoofs", "login": "h&f", "method": "clients_interests", "arguments": arguments}
+        set_interests(self.store, 1, ["books", "music"])
+        set_interests(self.store, 2, ["travel"])
+
+        self.set_valid_auth(request)
+        response, code = self.get_response(request)
+        self.assertEqual(api.OK, code)
+        self.assertEqual(response, {1: ["books", "music"], 2: ["travel"]})
+
+        etag = self.context["etag"]
+        self.headers = {"If-None-Match": '"%s"' % etag}
+        self.context = {}
+        _, code = self.get_response(request)
+        self.assertEqual(api.NOT_MODIFIED, code)
+
+        set_interests(self.store, 2, ["sport"])
+        self.context = {}
+        response, code = self.get_response(request)
+        self.assertEqual(api.OK, code)
+        self.assertEqual(response[2], ["sport"])
+        self.assertNotEqual(etag, self.context["etag"])
+
+    @cases([
+        {"client_ids": [5, 6]},
+    ])
+    def test_interests_local_cache_second_writer(self, arguments):
+        request = {"account": "horns&hoofs", "login": "h&f", "method": "clients_interests", "arguments": arguments}
+        self.store = Store(local_cache=LocalCache())
+        writer = Store()
+        set_interests(writer, 5, ["books"])
+        set_interests(writer, 6, ["travel"])
+        preload(self.store, "i:5")
+
+        self.set_valid_auth(request)
+        response, code = self.get_response(request)
+        self.assertEqual(response, {5: ["books"], 6: ["travel"]})
+        etag = self.context["etag"]
+
+        set_interests(writer, 5, ["sport"])
+        self.context = {}
+        response, code = self.get_response(request)
+        self.assertEqual(api.OK, code)
+        self.assertEqual(response, {5: ["sport"], 6: ["travel"]})
+        self.assertNotEqual(etag, self.context["etag"])
+
+    @cases([
+        {"client_ids": [3, 4], "date": "19.07.2017"},
+    ])
+    def test_interests_as_of_date(self, arguments):
+        request = {"account": "horns&hoofs", "login": "h&f", "method": "clients_interests", "arguments": arguments}
+        retention_days = (datetime.date.today() - datetime.date(2017, 1, 1)).days
+        set_interests(self.store, 3, ["books"], date=datetime.date(2017, 7, 1), retention_days=retention_days)
+        set_interests(self.store, 3, ["music"], date=datetime.date(2017, 8, 1), retention_days=retention_days)
+        set_interests(self.store, 4, ["travel"], date=datetime.date(2017, 8, 1), retention_days=retention_days)
+
+        self.set_valid_auth(request)
+        response, code = self.get_response(request)
+        self.assertEqual(api.OK, code)
+        self.assertEqual(response, {3: ["books"], 4: []})
+
+    @cases([
+        {"client_ids": [7]},
+    ])
+    def test_interests_future_date(self, arguments):
+        request = {"account": "horns&hoofs", "login": "h&f", "method": "clients_interests", "arguments": arguments}
+        today = datetime.date.today()
+        set_interests(self.store, 7, ["now"])
+        set_interests(self.store, 7, ["future"], date=today + datetime.timedelta(days=30))
+
+        self.set_valid_auth(request)
+        for date, expected in [(None, ["now"]), (today, ["now"]), (today + datetime.timedelta(days=30), ["future"])]:
+            if date is not None:
+                arguments["date"] = date.strftime("%d.%m.%Y")
+            self.context = {}
+            response, code = self.get_response(request)
+            self.assertEqual(api.OK, code)
+            self.assertEqual(response, {7: expected})
+
+    @cases([
+        {"client_ids": [8]},
+    ])
+    def test_interests_legacy_key(self, arguments):
+        request = {"account": "horns&hoofs", "login": "h&f", "method": "clients_interests", "arguments": arguments}
+        # интересы, записанные до появления истории, есть только в i:<cid>
+        self.store.set("i:8", '["legacy"]')
+        self.store.incr("iv:8")
+        today = datetime.date.today()
+
+        self.set_valid_auth(request)
+        for date, expected in [(None, ["legacy"]), (today, ["legacy"]),
+                               (today + datetime.timedelta(days=1), ["legacy"]),
+                               (today - datetime.timedelta(days=1), [])]:
+            if date is not None:
+                arguments["date"] = date.strftime("%d.%m.%Y")
+            self.context = {}
+            response, code = self.get_response(request)
+            self.assertEqual(api.OK, code)
+            self.assertEqual(response, {8: expected})
+
+    def get_cached_response(self, request, interests_cache):
+        self.context = {"interests_cache": interests_cache}
+        response, code = self.get_response(request)
+        self.assertEqual(api.OK, code)
+        return response
+
+    @cases([
+        {"client_ids": [11, 12]},
+    ])
+    def test_interests_cache_hit(self, arguments):
+        request = {"account": "horns&hoofs", "login": "h&f", "method": "clients_interests", "arguments": arguments}
+        self.store = CountingStore()
+        interests_cache = LocalCache()
+        set_interests(self.store, 11, ["books"])
+        set_interests(self.store, 12, ["travel"])
+
+        self.set_valid_auth(request)
+        response = self.get_cached_response(request, interests_cache)
+        self.assertEqual(response, {11: ["books"], 12: ["travel"]})
+        # тот же список в другом порядке берется из кэша без запроса интересов
+        arguments["client_ids"] = [12, 11, 12]
+        self.assertEqual(self.get_cached_response(request, interests_cache), response)
+        self.assertEqual(self.store.reads, 1)
+
+        # новая версия интересов не совпадает с закэшированной, ответ читается заново
+        set_interests(self.store, 12, ["sport"])
+        self.assertEqual(self.get_cached_response(request, interests_cache), {11: ["books"], 12: ["sport"]})
+        self.assertEqual(self.store.reads, 2)
+
+    @cases([
+        {"client_ids": [13], "date": "1.7.2017"},
+    ])
+    def test_interests_cache_date(self, arguments):
+        request = {"account": "horns&hoofs", "login": "h&f", "method": "clients_interests", "arguments": arguments}
+        self.store = CountingStore()
+        interests_cache = LocalCache()
+        retention_days = (datetime.date.today() - datetime.date(2017, 1, 1)).days
+        set_interests(Store(), 13, ["books"], date=datetime.date(2017, 7, 1), retention_days=retention_days)
+
+        self.set_valid_auth(request)
+        self.assertEqual(self.get_cached_response(request, interests_cache), {13: ["books"]})
+        etag = self.context["etag"]
+        # та же дата в другой записи дает тот же etag и тот же элемент кэша
+        arguments["date"] = "01.07.2017"
+        self.assertEqual(self.get_cached_response(request, interests_cache), {13: ["books"]})
+        self.assertEqual(etag, self.context["etag"])
+        self.assertEqual(self.store.reads, 1)
+        self.assertEqual(len(interests_cache), 1)
+
+    @cases([
+        {"client_ids": [14]},
+    ])
+    def test_interests_cache_eviction(self, arguments):
+        request = {"account": "horns&hoofs", "login": "h&f", "method": "clients_interests", "arguments": arguments}
+        self.store = CountingStore()
+        interests_cache = LocalCache(maxsize=1)
+        set_interests(self.store, 14, ["books"])
+        set_interests(self.store, 15, ["travel"])
+
+        self.set_valid_auth(request)
+        self.get_cached_response(request, interests_cache)
+        arguments["client_ids"] = [15]
+        self.get_cached_response(request, interests_cache)
+        # результат для [14] вытеснен результатом для [15]
+        arguments["client_ids"] = [14]
+        self.assertEqual(self.get_cached_response(request, interests_cache), {14: ["books"]})
+        self.assertEqual(self.store.reads, 3)
+        self.assertEqual(len(interests_cache), 1)
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,139 @@
+import unittest
+import json
+import os
+import socket
+import tempfile
+import threading
+from http.client import HTTPConnection
+from http.server import ThreadingHTTPServer
+from utils import cases
+from store import Store
+from unixsocket import UnixHTTPServer, UnixHTTPConnection
+from warmup import CacheWarmer
+import api
+
+REDIS_SOCKET = os.environ.get('REDIS_SOCKET', '/var/run/redis/redis.sock')
+
+
+class TestServer(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.tcp = ThreadingHTTPServer(("localhost", 0), api.MainHTTPHandler)
+        self.unix = UnixHTTPServer(os.path.join(self.directory.name, 'api.sock'), api.MainHTTPHandler, 0o600)
+        for server in (self.tcp, self.unix):
+            threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    def tearDown(self):
+        for server in (self.tcp, self.unix):
+            server.shutdown()
+            server.server_close()
+        self.directory.cleanup()
+
+    def get_response(self, conn, request):
+        conn.request('POST', '/method/', json.dumps(request), {'Content-Type': 'application/json'})
+        response = conn.getresponse()
+        return response.status, json.loads(response.read())
+
+    @cases([
+        {"phone": "79175002040", "email": "stupnikov@otus.ru"},
+    ])
+    def test_admin_score(self, arguments):
+        request = {"account": "horns&hoofs", "login": api.ADMIN_LOGIN, "method": "online_score",
+                   "token": api.get_admin_token(), "arguments": arguments}
+        for conn in (HTTPConnection('localhost', self.tcp.server_port),
+                     UnixHTTPConnection(self.unix.server_address)):
+            status, body = self.get_response(conn, request)
+            self.assertEqual(status, api.OK)
+            self.assertEqual(body, {"response": {"score": 42}, "code": api.OK})
+
+    def test_unix_socket_mode(self):
+        self.assertEqual(os.stat(self.unix.server_address).st_mode & 0o777, 0o600)
+
+    def test_unix_socket_removed(self):
+        path = self.unix.server_address
+        self.unix.server_close()
+        self.assertFalse(os.path.exists(path))
+
+    def test_unix_socket_in_use(self):
+        with self.assertRaises(OSError):
+            UnixHTTPServer(self.unix.server_address, api.MainHTTPHandler)
+        # работающий сервер остался на своем сокете
+        status, _ = self.get_response(UnixHTTPConnection(self.unix.server_address), {"method": "online_score"})
+        self.assertEqual(status, api.INVALID_REQUEST)
+
+    def test_unix_socket_not_a_socket(self):
+        path = os.path.join(self.directory.name, 'data.txt')
+        with open(path, 'w') as f:
+            f.write('data')
+        with self.assertRaises(OSError):
+            UnixHTTPServer(path, api.MainHTTPHandler)
+        with open(path) as f:
+            self.assertEqual(f.read(), 'data')
+
+    def test_unix_socket_stale(self):
+        path = os.path.join(self.directory.name, 'stale.sock')
+        # сокет без слушающего сервера, как после аварийного завершения
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.bind(path)
+        server = UnixHTTPServer(path, api.MainHTTPHandler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        try:
+            status, _ = self.get_response(UnixHTTPConnection(path), {"method": "online_score"})
+            self.assertEqual(status, api.INVALID_REQUEST)
+        finally:
+            server.shutdown()
+            server.server_close()
+        self.assertFalse(os.path.exists(path))
+
+
+class DictStore:
+    def __init__(self, data):
+        self.data = data
+
+    def get(self, key, deadline=None):
+        return self.data[key]
+
+
+class TestHealth(unittest.TestCase):
+    def setUp(self):
+        warmer = CacheWarmer(DictStore({'uid:1': '1.5'}), ['uid:1'])
+        handler = type('Handler', (api.MainHTTPHandler,), {'warmer': warmer})
+        self.server = ThreadingHTTPServer(("localhost", 0), handler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def get_health(self, path='/health'):
+        conn = HTTPConnection('localhost', self.server.server_port)
+        conn.request('GET', path)
+        response = conn.getresponse()
+        return response.status, json.loads(response.read())
+
+    def test_health(self):
+        status, body = self.get_health()
+        self.assertEqual(status, api.SERVICE_UNAVAILABLE)
+        self.assertEqual(body["error"], {'ready': False, 'total': 1, 'loaded': 0, 'failed': 0})
+
+        self.server.RequestHandlerClass.warmer.start().join()
+        status, body = self.get_health()
+        self.assertEqual(status, api.OK)
+        self.assertEqual(body["response"], {'ready': True, 'total': 1, 'loaded': 1, 'failed': 0})
+
+    def test_not_found(self):
+        status, _ = self.get_health('/status')
+        self.assertEqual(status, api.NOT_FOUND)
+
+
+@unittest.skipUnless(os.path.exists(REDIS_SOCKET), f'нет unix socket redis {REDIS_SOCKET}')
+class TestUnixSocketStore(unittest.TestCase):
+
+    def test_cache(self):
+        store = Store(unix_socket_path=REDIS_SOCKET)
+        store.cache_set('unix:key', 5.0, 60)
+        self.assertEqual(float(store.get('unix:key')), 5.0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,56 @@
+import gzip
+import unittest
+from utils import cases
+from compression import Compressor, negotiate, decompress, brotli
+
+
+class TestCompression(unittest.TestCase):
+
+    @cases([
+        ['gzip', ['gzip'], 'gzip'],
+        ['gzip, br', ['gzip', 'br'], 'br'],
+        ['gzip;q=1.0, br;q=0.5', ['gzip', 'br'], 'gzip'],
+        ['br, zstd, gzip', ['gzip', 'br', 'zstd'], 'zstd'],
+        ['*', ['gzip'], 'gzip'],
+        ['gzip;q=0', ['gzip'], None],
+        ['identity', ['gzip'], None],
+        ['', ['gzip'], None],
+    ])
+    def test_negotiate(self, case):
+        header, encodings, expected = case
+        self.assertEqual(negotiate(header, encodings), expected)
+
+    def test_compress_threshold(self):
+        compressor = Compressor(min_size=100)
+        small = b'{"code": 200}'
+        self.assertEqual(compressor.compress(small, 'gzip'), (small, None))
+
+        big = b'{"response": {"1": ["books", "music"]}}' * 100
+        data, encoding = compressor.compress(big, 'gzip')
+        self.assertEqual(encoding, 'gzip')
+        self.assertLess(len(data), len(big))
+        self.assertEqual(decompress(data, 'gzip'), big)
+
+    def test_decompress_limit(self):
+        data = gzip.compress(b'0' * 1000)
+        self.assertEqual(decompress(data, 'gzip', max_size=1000), b'0' * 1000)
+        with self.assertRaises(ValueError):
+            decompress(data, 'gzip', max_size=999)
+
+    @unittest.skipIf(brotli is None, 'brotli не установлен')
+    def test_decompress_limit_br(self):
+        data = brotli.compress(b'0' * 1000)
+        self.assertEqual(decompress(data, 'br', max_size=1000), b'0' * 1000)
+        with self.assertRaises(ValueError):
+            decompress(data, 'br', max_size=999)
+        with self.assertRaises(ValueError):
+            decompress(brotli.compress(b'0' * 100 * 1024 * 1024), 'br', max_size=1024)
+
+    def test_decompress_unknown(self):
+        self.assertEqual(decompress(b'{}', 'identity'), b'{}')
+        with self.assertRaises(ValueError):
+            decompress(b'{}', 'compress')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,66 @@
+import unittest
+from utils import cases
+from limits import RateLimiter
+import api
+
+
+class TestRateLimiter(unittest.TestCase):
+
+    def test_bucket_refill(self):
+        limiter = RateLimiter(rate=1, burst=2)
+        self.assertTrue(limiter.allow(('horns&hoofs', 'h&f'), now=0))
+        self.assertTrue(limiter.allow(('horns&hoofs', 'h&f'), now=0))
+        self.assertFalse(limiter.allow(('horns&hoofs', 'h&f'), now=0))
+        self.assertTrue(limiter.allow(('horns&hoofs', 'h&f'), now=1))
+
+    def test_buckets_per_account(self):
+        limiter = RateLimiter(rate=1, burst=1)
+        self.assertTrue(limiter.allow(('horns&hoofs', 'h&f'), now=0))
+        self.assertFalse(limiter.allow(('horns&hoofs', 'h&f'), now=0))
+        self.assertTrue(limiter.allow(('horns&hoofs', 'other'), now=0))
+
+    def test_buckets_bounded(self):
+        limiter = RateLimiter(rate=1, burst=1, max_buckets=2)
+        for login in ['a', 'b', 'c']:
+            limiter.allow(('acc', login), now=0)
+        self.assertEqual(len(limiter.buckets), 2)
+
+    def test_inflight(self):
+        limiter = RateLimiter(max_inflight=1)
+        self.assertTrue(limiter.acquire())
+        self.assertFalse(limiter.acquire())
+        limiter.release()
+        self.assertTrue(limiter.acquire())
+
+    def test_disabled(self):
+        limiter = RateLimiter()
+        self.assertTrue(all(limiter.allow(('acc', 'login'), now=0) for _ in range(100)))
+        self.assertTrue(all(limiter.acquire() for _ in range(100)))
+
+
+class TestRateLimitKey(unittest.TestCase):
+
+    def test_authenticated(self):
+        request = {"account": "horns&hoofs", "login": "h&f", "token": api.get_user_token("horns&hoofs", "h&f")}
+        self.assertEqual(api.rate_limit_key(request), ("horns&hoofs", "h&f"))
+
+    def test_admin(self):
+        request = {"login": api.ADMIN_LOGIN, "token": api.get_admin_token()}
+        self.assertEqual(api.rate_limit_key(request), ("", api.ADMIN_LOGIN))
+
+    @cases([
+        {"account": ["x"], "login": "h&f", "token": "t"},
+        {"account": "horns&hoofs", "login": {"x": 1}, "token": "t"},
+        {"account": "horns&hoofs", "login": "h&f", "token": ["t"]},
+        {"account": "horns&hoofs", "login": "h&f", "token": "spoofed"},
+        {"account": "horns&hoofs", "login": "h&f"},
+        ["not", "a", "dict"],
+    ])
+    def test_shared_bucket(self, request):
+        key = api.rate_limit_key(request)
+        self.assertIsNone(key)
+        self.assertTrue(RateLimiter(rate=1).allow(key, now=0))
+
+
+if __name__ == '__main__':
+    unittest.main()
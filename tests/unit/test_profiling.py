@@ -0,0 +1,62 @@
+import json
+import os
+import tempfile
+import time
+import unittest
+from profiling import StackSampler, RequestProfiler
+
+
+def inner():
+    return json.loads('[' + ','.join(['1'] * 10000) + ']')
+
+
+def outer():
+    return len(inner())
+
+
+def busy(seconds=0.2):
+    finish = time.monotonic() + seconds
+    while time.monotonic() < finish:
+        outer()
+    return outer()
+
+
+class TestProfiling(unittest.TestCase):
+
+    def test_collapsed_stacks(self):
+        with StackSampler(interval=0.001) as profiler:
+            busy()
+        stacks = list(profiler.stacks)
+        self.assertTrue(stacks)
+        # стеки начинаются с профилируемой функции, кадры тестов и самого сэмплера в них не попадают
+        for stack in stacks:
+            self.assertTrue(stack.startswith(f'{__name__}.busy'), stack)
+            self.assertNotIn('StackSampler', stack)
+        self.assertTrue(any(stack.startswith(f'{__name__}.busy;{__name__}.outer;{__name__}.inner')
+                            for stack in stacks))
+        for line in profiler.collapsed().splitlines():
+            stack, value = line.rsplit(' ', 1)
+            self.assertGreater(int(value), 0)
+
+    def test_sampler_stopped(self):
+        with StackSampler(interval=0.001) as profiler:
+            pass
+        self.assertFalse(profiler.thread.is_alive())
+        time.sleep(0.01)
+        busy(0.01)
+        self.assertEqual(profiler.collapsed(), '')
+
+    def test_request_profiler(self):
+        with tempfile.TemporaryDirectory() as output_dir:
+            profiler = RequestProfiler(output_dir, interval=0.001)
+            self.assertFalse(profiler.sampled())
+            self.assertEqual(profiler.run('abc', busy), 10000)
+            files = os.listdir(output_dir)
+            self.assertEqual(len(files), 1)
+            self.assertTrue(files[0].endswith('-abc.folded'))
+            with open(os.path.join(output_dir, files[0])) as f:
+                self.assertIn(f'{__name__}.busy', f.read())
+
+
+if __name__ == '__main__':
+    unittest.main()
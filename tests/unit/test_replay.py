@@ -0,0 +1,117 @@
+import gzip
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+import unittest
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from utils import cases
+from capture import TrafficRecorder, read_capture
+from replay import Replayer, sign, percentile
+
+
+class ETagHandler(BaseHTTPRequestHandler):
+    """Сервер с одним ответом и etag "abc", каждый запрос обрабатывается delay секунд"""
+    delay = 0
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers['Content-Length']))
+        time.sleep(self.delay)
+        if self.headers.get('If-None-Match') == '"abc"':
+            self.send_response(304)
+            self.end_headers()
+            return
+        data = json.dumps({"response": {"1": ["книги"]}, "code": 200}).encode()
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class TestReplay(unittest.TestCase):
+
+    @cases(['capture.jsonl', 'capture.jsonl.gz'])
+    def test_capture_roundtrip(self, name):
+        body = {"account": "horns&hoofs", "login": "h&f", "method": "clients_interests",
+                "token": "secret", "arguments": {"client_ids": [1, 2]}}
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, name)
+            recorder = TrafficRecorder(path)
+            recorder.record(1.5, '/method/', 'abc', body, 200, {"1": ["книги"]},
+                            {'If-None-Match': '"abc"', 'X-Request-Timeout': '2', 'X-Profile-Token': 'secret'})
+            recorder.record(1.6, '/method/', 'def', body, 200, {"1": ["книги"]})
+            recorder.close()
+            records = list(read_capture(path))
+        expected = {key: value for key, value in body.items() if key != 'token'}
+        self.assertEqual(records, [{'t': 1.5, 'path': '/method/', 'id': 'abc', 'body': expected,
+                                    'code': 200, 'response': {"1": ["книги"]},
+                                    'headers': {'If-None-Match': '"abc"', 'X-Request-Timeout': '2'}},
+                                   {'t': 1.6, 'path': '/method/', 'id': 'def', 'body': expected,
+                                    'code': 200, 'response': {"1": ["книги"]}}])
+        self.assertNotIn('token', records[0]['body'])
+        self.assertEqual(body['token'], 'secret')
+
+    def test_capture_gz_flush(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'capture.jsonl.gz')
+            recorder = TrafficRecorder(path, flush_interval=0)
+            recorder.record(1.5, '/method/', 'abc', {"method": "online_score"}, 200, {})
+            # запись читается до закрытия файла
+            with gzip.open(path, 'rb') as f:
+                data = f.read1()
+            recorder.close()
+        self.assertIn(b'"id":"abc"', data)
+
+    def start_server(self, delay=0):
+        handler = type('Handler', (ETagHandler,), {'delay': delay})
+        server = ThreadingHTTPServer(('localhost', 0), handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        return f'http://localhost:{server.server_port}'
+
+    def test_replay_not_modified(self):
+        replayer = Replayer(self.start_server())
+        body = {"account": "horns&hoofs", "login": "h&f", "method": "clients_interests"}
+        replayer.send({'t': 0, 'path': '/method/', 'id': 'abc', 'body': body, 'code': 304, 'response': {},
+                       'headers': {'If-None-Match': '"abc"'}})
+        replayer.send({'t': 0, 'path': '/method/', 'id': 'def', 'body': body, 'code': 200,
+                       'response': {"1": ["книги"]}})
+        self.assertEqual(replayer.codes, {304: 1, 200: 1})
+        self.assertEqual(replayer.diffs, [])
+
+    def test_replay_lag(self):
+        # один поток на три одновременных запроса по 0.1 с: последний ждет очереди 0.2 с
+        replayer = Replayer(self.start_server(delay=0.1), concurrency=1)
+        body = {"account": "horns&hoofs", "login": "h&f", "method": "clients_interests"}
+        replayer.run([{'t': 0, 'path': '/method/', 'id': str(i), 'body': body, 'code': 200,
+                       'response': {"1": ["книги"]}} for i in range(3)])
+        self.assertEqual(len(replayer.lags), 3)
+        self.assertGreaterEqual(max(replayer.lags), 0.15)
+        self.assertGreaterEqual(max(replayer.latencies), 0.25)
+        self.assertIn('Отставание от расписания', replayer.report(1.0))
+
+    def test_sign(self):
+        body = {"account": "horns&hoofs", "login": "h&f", "token": "old"}
+        signed = sign(body, salt='test')
+        self.assertEqual(signed['token'], hashlib.sha512('horns&hoofsh&ftest'.encode()).hexdigest())
+        self.assertEqual(body['token'], 'old')
+
+    @cases([
+        [50, 5],
+        [90, 9],
+        [99, 10],
+        [100, 10],
+    ])
+    def test_percentile(self, case):
+        p, expected = case
+        self.assertEqual(percentile(list(range(1, 11)), p), expected)
+
+
+if __name__ == '__main__':
+    unittest.main()
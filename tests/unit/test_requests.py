@@ -0,0 +1,35 @@
+import unittest
+from utils import cases
+import api
+
+
+class TestRequest(unittest.TestCase):
+
+    @cases([
+        (api.MethodRequest, {"account": "horns&hoofs", "login": "h&f", "method": "online_score"}),
+        (api.OnlineScoreRequest, {"phone": "79175002040", "email": "stupnikov@otus.ru", "gender": 1}),
+        (api.ClientsInterestsRequest, {"client_ids": [1, 2]}),
+    ])
+    def test_fields(self, request_class, arguments):
+        request = request_class(request_fields=arguments)
+        self.assertFalse(hasattr(request, '__dict__'))
+        for name in request_class.fields:
+            self.assertEqual(getattr(request, name), arguments.get(name) or '')
+        with self.assertRaises(AttributeError):
+            request.unknown = 1
+
+    def test_missing_fields(self):
+        request = api.OnlineScoreRequest(request_fields={"gender": 0})
+        self.assertEqual(request.phone, '')
+        self.assertEqual(request.birthday, '')
+        self.assertEqual(request.gender, '')
+
+    def test_methods_registry(self):
+        self.assertEqual(set(api.METHODS), {'online_score', 'clients_interests'})
+        for request_class, handler in api.METHODS.values():
+            self.assertTrue(issubclass(request_class, api.BaseRequest))
+            self.assertTrue(callable(handler))
+
+
+if __name__ == '__main__':
+    unittest.main()
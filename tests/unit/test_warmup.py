@@ -0,0 +1,65 @@
+import os
+import tempfile
+import unittest
+from store import LocalCache
+from scoring import get_interests_key
+from warmup import CacheWarmer, hot_keys_from_log
+
+
+class DictStore:
+    def __init__(self, data):
+        self.data = data
+        self.requested = []
+
+    def get(self, key, deadline=None):
+        self.requested.append(key)
+        if key not in self.data:
+            raise KeyError(key)
+        return self.data[key]
+
+
+class TestLocalCache(unittest.TestCase):
+
+    def test_ttl(self):
+        cache = LocalCache(ttl=10)
+        cache.set('i:1', '["books"]', now=0)
+        self.assertEqual(cache.get('i:1', now=5), '["books"]')
+        self.assertIsNone(cache.get('i:1', now=10))
+
+    def test_maxsize(self):
+        cache = LocalCache(maxsize=2)
+        for key in ['i:1', 'i:2', 'i:3']:
+            cache.set(key, '[]', now=0)
+        self.assertEqual(len(cache), 2)
+        self.assertIsNone(cache.get('i:1', now=0))
+
+
+class TestWarmup(unittest.TestCase):
+
+    def test_hot_keys_from_log(self):
+        lines = [
+            '[2022.01.01 10:00:00] I /method/: b\'{"method": "clients_interests", '
+            '"arguments": {"client_ids": [1, 2]}}\' 0123abcd\n',
+            '[2022.01.01 10:00:01] I /method/: b\'{"method": "clients_interests", '
+            '"arguments": {"client_ids": [2]}}\' 4567abcd\n',
+            '[2022.01.01 10:00:02] I {\'request_id\': \'0123abcd\', \'code\': 200}\n',
+        ]
+        with tempfile.NamedTemporaryFile('w', suffix='.log', delete=False) as f:
+            f.writelines(lines)
+        try:
+            keys = hot_keys_from_log(f.name, limit=1)
+        finally:
+            os.remove(f.name)
+        self.assertEqual(keys, [get_interests_key(2)])
+
+    def test_warmer(self):
+        store = DictStore({'uid:1': '1.5', 'uid:2': '3.0'})
+        warmer = CacheWarmer(store, ['uid:1', 'uid:2', 'uid:3'], concurrency=2)
+        self.assertFalse(warmer.ready.is_set())
+        warmer.start().join()
+        self.assertEqual(warmer.status(), {'ready': True, 'total': 3, 'loaded': 2, 'failed': 1})
+        self.assertEqual(sorted(store.requested), ['uid:1', 'uid:2', 'uid:3'])
+
+
+if __name__ == '__main__':
+    unittest.main()
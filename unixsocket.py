@@ -0,0 +1,74 @@
+import errno
+import os
+import socket
+import socketserver
+import stat
+from http.client import HTTPConnection
+from http.server import ThreadingHTTPServer
+
+
+class UnixHTTPServer(ThreadingHTTPServer):
+    """HTTP-сервер на unix domain socket, mode - права на файл сокета"""
+    address_family = socket.AF_UNIX
+
+    def __init__(self, path, handler_class, mode=None):
+        self.mode = mode
+        # при ошибке bind TCPServer.__init__ вызывает server_close, а чужой сокет удалять нельзя
+        self.bound = False
+        super().__init__(path, handler_class)
+
+    def server_bind(self):
+        remove_stale_socket(self.server_address)
+        socketserver.TCPServer.server_bind(self)
+        self.bound = True
+        if self.mode is not None:
+            os.chmod(self.server_address, self.mode)
+        self.server_name = 'localhost'
+        self.server_port = 0
+
+    def get_request(self):
+        # у клиента unix сокета нет адреса, а обработчик пишет в лог client_address[0]
+        request, _ = self.socket.accept()
+        return request, (self.server_address, 0)
+
+    def server_close(self):
+        super().server_close()
+        if not self.bound:
+            return
+        self.bound = False
+        try:
+            if stat.S_ISSOCK(os.lstat(self.server_address).st_mode):
+                os.unlink(self.server_address)
+        except FileNotFoundError:
+            pass
+
+
+def remove_stale_socket(path):
+    """Удаление файла сокета, оставшегося от предыдущего запуска.
+    Файл другого типа не трогается, а если на сокете отвечает живой сервер - ошибка"""
+    try:
+        st = os.lstat(path)
+    except FileNotFoundError:
+        return
+    if not stat.S_ISSOCK(st.st_mode):
+        raise OSError(errno.EEXIST, 'Путь существует и не является сокетом', path)
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        try:
+            sock.connect(path)
+        except (ConnectionRefusedError, FileNotFoundError):
+            pass
+        else:
+            raise OSError(errno.EADDRINUSE, 'На сокете уже работает сервер', path)
+    os.unlink(path)
+
+
+class UnixHTTPConnection(HTTPConnection):
+    def __init__(self, path, timeout=socket._GLOBAL_DEFAULT_TIMEOUT):
+        super().__init__('localhost', timeout=timeout)
+        self.socket_path = path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        if self.timeout is not socket._GLOBAL_DEFAULT_TIMEOUT:
+            self.sock.settimeout(self.timeout)
+        self.sock.connect(self.socket_path)
@@ -0,0 +1,93 @@
+import ast
+import datetime
+import json
+import logging
+import re
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+from scoring import get_score_key, get_interests_key, preload
+
+# строка лога запроса из MainHTTPHandler.do_POST: "<path>: b'<тело запроса>' <request_id>"
+LOG_REQUEST_RE = re.compile(r": (b'.*') \S+$")
+
+
+def load_keys(path):
+    """Ключи для прогрева из файла, по одному на строку"""
+    with open(path) as f:
+        return [line.strip() for line in f if line.strip()]
+
+
+def request_keys(request):
+    """Ключи хранилища, которые затронет запрос к api"""
+    arguments = request.get('arguments') or {}
+    if request.get('method') == 'clients_interests':
+        return [get_interests_key(cid) for cid in arguments.get('client_ids') or []]
+    if request.get('method') == 'online_score':
+        try:
+            birthday = datetime.datetime.strptime(arguments['birthday'], '%d.%m.%Y')
+        except (KeyError, TypeError, ValueError):
+            birthday = None
+        return [get_score_key(phone=arguments.get('phone'),
+                              birthday=birthday,
+                              first_name=arguments.get('first_name'),
+                              last_name=arguments.get('last_name'))]
+    return []
+
+
+def hot_keys_from_log(path, limit=1000):
+    """Самые часто запрашиваемые ключи по логу запросов api"""
+    counter = Counter()
+    with open(path) as f:
+        for line in f:
+            match = LOG_REQUEST_RE.search(line.rstrip())
+            if not match:
+                continue
+            try:
+                request = json.loads(ast.literal_eval(match.group(1)))
+                counter.update(request_keys(request))
+            except (ValueError, SyntaxError, TypeError, AttributeError):
+                continue
+    return [key for key, _ in counter.most_common(limit)]
+
+
+class CacheWarmer:
+    """Фоновая загрузка ключей в локальный кэш хранилища с ограниченным параллелизмом"""
+    def __init__(self, store, keys, concurrency=8):
+        self.store = store
+        self.keys = keys
+        self.concurrency = concurrency
+        self.loaded = 0
+        self.failed = 0
+        self.ready = threading.Event()
+
+    def start(self):
+        thread = threading.Thread(target=self.run, name='cache-warmer', daemon=True)
+        thread.start()
+        return thread
+
+    def run(self):
+        logging.info(f'Прогрев кэша: {len(self.keys)} ключей')
+        try:
+            with ThreadPoolExecutor(max_workers=self.concurrency) as pool:
+                for ok in pool.map(self.load, self.keys):
+                    if ok:
+                        self.loaded += 1
+                    else:
+                        self.failed += 1
+        finally:
+            logging.info(f'Прогрев кэша завершен: загружено {self.loaded}, ошибок {self.failed}')
+            self.ready.set()
+
+    def load(self, key):
+        try:
+            preload(self.store, key)
+            return True
+        except Exception as err:
+            logging.error(f'Не удалось прогреть ключ "{key}": {err}')
+            return False
+
+    def status(self):
+        return {'ready': self.ready.is_set(), 'total': len(self.keys),
+                'loaded': self.loaded, 'failed': self.failed}